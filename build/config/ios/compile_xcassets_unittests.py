@@ -2,6 +2,9 @@
 # Use of this source code is governed by a BSD-style license that can be
 # found in the LICENSE file.
 
+import io
+import os
+import tempfile
 import unittest
 import compile_xcassets
 
@@ -136,6 +139,190 @@ class TestFilterCompilerOutput(unittest.TestCase):
             '/* com.apple.actool.compilation-results */\n',
             self.relative_paths))
 
+  def testOverlappingHeaderDelimiters(self):
+    self.assertEquals(
+        '/* com.apple.actool.errors */\n'
+        '/* */\n'
+        'foo\n',
+        compile_xcassets.FilterCompilerOutput(
+            '/* com.apple.actool.errors */\n'
+            '/* */\n'
+            'foo\n',
+            self.relative_paths))
+
+  def testWriteFilteredCompilerOutput(self):
+    filtered_output = io.StringIO()
+    has_output = compile_xcassets.WriteFilteredCompilerOutput(
+        iter([
+            '/* com.apple.actool.errors */',
+            '/Users/janedoe/chromium/src/Chromium.xcassets: error: The output '
+                'directory "/Users/janedoe/chromium/src/out/Default/Chromium.a'
+                'pp" does not exist.',
+            '/* com.apple.actool.compilation-results */',
+        ]),
+        self.relative_paths,
+        compile_xcassets.AbsolutePathsPattern(self.relative_paths),
+        filtered_output)
+    self.assertTrue(has_output)
+    self.assertEquals(
+        '/* com.apple.actool.errors */\n'
+        '../../Chromium.xcassets: error: The output directory "/Users/janedoe/'
+            'chromium/src/out/Default/Chromium.app" does not exist.\n',
+        filtered_output.getvalue())
+
+
+class TestFixAbsolutePathInLine(unittest.TestCase):
+
+  relative_paths = {
+    '/Users/janedoe/chromium/src/out/Default/Chromium.app':
+        'Chromium.app',
+    '/Users/janedoe/chromium/src/out/Default/Chromium.app/Assets.car':
+        'Chromium.app/Assets.car',
+  }
+
+  def _FixAbsolutePathInLine(self, line):
+    return compile_xcassets.FixAbsolutePathInLine(
+        line, self.relative_paths,
+        compile_xcassets.AbsolutePathsPattern(self.relative_paths))
+
+  def testLongestPath(self):
+    self.assertEquals(
+        'Chromium.app/Assets.car: error: failed',
+        self._FixAbsolutePathInLine(
+            '/Users/janedoe/chromium/src/out/Default/Chromium.app/Assets.car: '
+                'error: failed'))
+
+  def testNoColon(self):
+    self.assertEquals(
+        'Chromium.app',
+        self._FixAbsolutePathInLine(
+            '/Users/janedoe/chromium/src/out/Default/Chromium.app'))
+
+  def testMultiplePaths(self):
+    self.assertEquals(
+        'error: cannot copy Chromium.app/Assets.car to Chromium.app',
+        self._FixAbsolutePathInLine(
+            'error: cannot copy /Users/janedoe/chromium/src/out/Default/Chromi'
+                'um.app/Assets.car to /Users/janedoe/chromium/src/out/Default/'
+                'Chromium.app'))
+
+  def testPartialPathComponent(self):
+    self.assertEquals(
+        '/Users/janedoe/chromium/src/out/Default/Chromium.app2/x: warning',
+        self._FixAbsolutePathInLine(
+            '/Users/janedoe/chromium/src/out/Default/Chromium.app2/x: warning'))
+
+  def testPathInPath(self):
+    self.assertEquals(
+        '/tmp/Users/janedoe/chromium/src/out/Default/Chromium.app: warning',
+        self._FixAbsolutePathInLine(
+            '/tmp/Users/janedoe/chromium/src/out/Default/Chromium.app: warni'
+                'ng'))
+
+  def testQuotedPath(self):
+    self.assertEquals(
+        'error: The output directory "Chromium.app" does not exist.',
+        self._FixAbsolutePathInLine(
+            'error: The output directory "/Users/janedoe/chromium/src/out/Defa'
+                'ult/Chromium.app" does not exist.'))
+
+  def testPathInParentheses(self):
+    self.assertEquals(
+        'warning: unused (Chromium.app), Chromium.app/Assets.car,x',
+        self._FixAbsolutePathInLine(
+            'warning: unused (/Users/janedoe/chromium/src/out/Default/Chromium'
+                '.app), /Users/janedoe/chromium/src/out/Default/Chromium.app/A'
+                'ssets.car,x'))
+
+  def testEmptyRelativePath(self):
+    relative_paths = {'/Users/janedoe/chromium/src/out/Default': ''}
+    self.assertEquals(
+        './gen/foo.png: warning: x',
+        compile_xcassets.FixAbsolutePathInLine(
+            '/Users/janedoe/chromium/src/out/Default/gen/foo.png: warning: x',
+            relative_paths,
+            compile_xcassets.AbsolutePathsPattern(relative_paths)))
+
+  def testNoPath(self):
+    self.assertEquals(
+        '    Underlying Errors:',
+        self._FixAbsolutePathInLine('    Underlying Errors:'))
+
+  def testUnknownPath(self):
+    self.assertEquals(
+        '/Users/janedoe/chromium/src/Chromium.xcassets: error: failed',
+        self._FixAbsolutePathInLine(
+            '/Users/janedoe/chromium/src/Chromium.xcassets: error: failed'))
+
+
+class TestFindSpecialAssets(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.root = self.temp_dir.name
+    for path in ('Chromium.xcassets/AppIcon.appiconset',
+                 'Chromium.xcassets/LaunchImage.launchimage',
+                 'Chromium.xcassets/image1.imageset',
+                 'Other.xcassets/OtherIcon.appiconset',
+                 'Other.xcassets/AlternateIcon.appiconset'):
+      os.makedirs(os.path.join(self.root, path))
+    with open(os.path.join(self.root, 'Chromium.xcassets', 'File.appiconset'),
+              'w'):
+      pass
+    with open(os.path.join(self.root, 'Contents.json'), 'w'):
+      pass
+
+  def tearDown(self):
+    self.temp_dir.cleanup()
+
+  def testNotDirectory(self):
+    self.assertEquals(
+        [],
+        compile_xcassets.FindSpecialAssets(
+            os.path.join(self.root, 'Contents.json')))
+
+  def testMissing(self):
+    self.assertEquals(
+        [],
+        compile_xcassets.FindSpecialAssets(
+            os.path.join(self.root, 'Missing.xcassets')))
+
+  def testSpecialAssets(self):
+    self.assertEquals(
+        [('.appiconset', 'AppIcon'), ('.launchimage', 'LaunchImage')],
+        sorted(
+            compile_xcassets.FindSpecialAssets(
+                os.path.join(self.root, 'Chromium.xcassets'))))
+
+  def testMultipleAppIcons(self):
+    self.assertEquals(
+        [('.appiconset', 'AlternateIcon'), ('.appiconset', 'OtherIcon')],
+        sorted(
+            compile_xcassets.FindSpecialAssets(
+                os.path.join(self.root, 'Other.xcassets'))))
+
+  def testInputs(self):
+    self.assertEquals([], compile_xcassets.FindSpecialAssetsInInputs([]))
+    self.assertEquals(
+        [('.appiconset', 'AlternateIcon'), ('.appiconset', 'OtherIcon')],
+        sorted(
+            compile_xcassets.FindSpecialAssetsInInputs([
+                os.path.join(self.root, 'Missing.xcassets'),
+                os.path.join(self.root, 'Other.xcassets'),
+            ])))
+    self.assertEquals(
+        [
+            ('.appiconset', 'AlternateIcon'),
+            ('.appiconset', 'AppIcon'),
+            ('.appiconset', 'OtherIcon'),
+            ('.launchimage', 'LaunchImage'),
+        ],
+        sorted(
+            compile_xcassets.FindSpecialAssetsInInputs([
+                os.path.join(self.root, 'Chromium.xcassets'),
+                os.path.join(self.root, 'Other.xcassets'),
+            ])))
+
 
 if __name__ == '__main__':
   unittest.main()
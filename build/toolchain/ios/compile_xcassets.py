@@ -17,6 +17,8 @@ an option to fail with non-zero error code when there are warnings.
 """
 
 import argparse
+import concurrent.futures
+import io
 import os
 import re
 import shutil
@@ -24,8 +26,10 @@ import subprocess
 import sys
 import tempfile
 
-# Pattern matching a section header in the output of actool.
-SECTION_HEADER = re.compile('^/\\* ([^ ]*) \\*/$')
+# Delimiters surrounding the name of a section header in the output of actool
+# (the section name itself does not contain any space).
+SECTION_HEADER_PREFIX = '/* '
+SECTION_HEADER_SUFFIX = ' */'
 
 # Name of the section containing informational messages that can be ignored.
 NOTICE_SECTION = 'com.apple.actool.compilation-results'
@@ -37,16 +41,81 @@ ACTOOL_FLAG_FOR_ASSET_TYPE = {
     '.launchimage': '--launch-image',
 }
 
-def FixAbsolutePathInLine(line, relative_paths):
-  """Fix absolute paths present in |line| to relative paths."""
-  absolute_path = line.split(':')[0]
-  relative_path = relative_paths.get(absolute_path, absolute_path)
-  if absolute_path == relative_path:
+# Map (platform, target environment) to the corresponding command-line
+# parameters that need to be passed to actool.
+ACTOOL_FLAGS_FOR_PLATFORM = {
+    ('mac', ''): (
+        '--platform',
+        'macosx',
+        '--target-device',
+        'mac',
+    ),
+    ('ios', 'simulator'): (
+        '--platform',
+        'iphonesimulator',
+        '--target-device',
+        'iphone',
+        '--target-device',
+        'ipad',
+    ),
+    ('ios', 'device'): (
+        '--platform',
+        'iphoneos',
+        '--target-device',
+        'iphone',
+        '--target-device',
+        'ipad',
+    ),
+    ('ios', 'catalyst'): (
+        '--platform',
+        'macosx',
+        '--target-device',
+        'ipad',
+        '--ui-framework-family',
+        'uikit',
+    ),
+}
+
+# Maximum number of threads used to scan the input directories.
+MAX_SCAN_WORKERS = 8
+
+def AbsolutePathsPattern(relative_paths):
+  """Returns a pattern matching any of the absolute paths of |relative_paths|.
+
+  The absolute paths are sorted by decreasing length so that the longest
+  (i.e. most specific) path is matched when one path is a prefix of another.
+  A path is only matched as a whole: it cannot be preceded by a character
+  that may be part of a path, nor followed by one (except a separator, so
+  that paths below a known directory are converted).
+  """
+  return re.compile(r'(?<![\w.+@~/-])(?:%s)(?![\w.+@~-])' % '|'.join(
+      re.escape(absolute_path)
+      for absolute_path in sorted(relative_paths, key=len, reverse=True)))
+
+
+def FixAbsolutePathInLine(line, relative_paths, absolute_paths_pattern):
+  """Fix absolute paths present in |line| to relative paths.
+
+  Args:
+    line: the line to fix
+    relative_paths: mapping from absolute to relative paths
+    absolute_paths_pattern: pattern returned by AbsolutePathsPattern() for
+      |relative_paths|
+  """
+  # All the paths are absolute, so a line without any separator cannot
+  # contain any of them (this is the case of most of the indented details
+  # of actool diagnostics).
+  if not relative_paths or os.sep not in line:
     return line
-  return relative_path + line[len(absolute_path):]
+  # The relative form of the current directory is empty (e.g. the directory
+  # of an output in the current directory), use "." so that the paths below
+  # it are not turned into wrong absolute paths.
+  return absolute_paths_pattern.sub(
+      lambda match: relative_paths[match.group(0)] or os.curdir, line)
 
 
-def FilterCompilerOutput(compiler_output, relative_paths):
+def WriteFilteredCompilerOutput(compiler_output_lines, relative_paths,
+                                absolute_paths_pattern, filtered_output):
   """Filers actool compilation output.
 
   The compiler output is composed of multiple sections for each different
@@ -61,6 +130,67 @@ def FilterCompilerOutput(compiler_output, relative_paths):
   See crbug.com/730054, crbug.com/739163 and crbug.com/770634 for some example
   messages that pollute the output of actool and cause flaky builds.
 
+  Args:
+    compiler_output_lines: iterable over the lines (without the trailing
+      newline) of the output generated by the compiler (contains both
+      stdout and stderr)
+    relative_paths: mapping from absolute to relative paths used to
+      convert paths in the warning and error messages (unknown paths
+      will be left unaltered)
+    absolute_paths_pattern: pattern returned by AbsolutePathsPattern() for
+      |relative_paths|
+    filtered_output: text stream where the filtered output of the compiler
+      is written. If the compilation was a success, then nothing will be
+      written, otherwise it will use relative path and omit any irrelevant
+      output.
+
+  Returns:
+    True if anything was written to |filtered_output|, False otherwise.
+  """
+
+  # Bind the attributes used for each line to local variables, as this loop
+  # is executed for every line of the compiler output.
+  write = filtered_output.write
+  header_prefix = SECTION_HEADER_PREFIX
+  header_suffix = SECTION_HEADER_SUFFIX
+  section_start = len(header_prefix)
+  section_end = -len(header_suffix)
+  # The prefix and suffix must not overlap (e.g. "/* */" is not a header).
+  header_min_length = len(header_prefix) + len(header_suffix)
+
+  current_section = None
+  keep_section = False
+  data_in_section = False
+  has_output = False
+  for line in compiler_output_lines:
+    if (len(line) >= header_min_length and line.startswith(header_prefix)
+        and line.endswith(header_suffix)):
+      section = line[section_start:section_end]
+      if ' ' not in section:
+        current_section = section
+        keep_section = bool(section) and section != NOTICE_SECTION
+        data_in_section = False
+        continue
+    if keep_section:
+      if not data_in_section:
+        data_in_section = True
+        has_output = True
+        write(header_prefix)
+        write(current_section)
+        write(header_suffix)
+        write('\n')
+
+      write(FixAbsolutePathInLine(line, relative_paths, absolute_paths_pattern))
+      write('\n')
+
+  return has_output
+
+
+def FilterCompilerOutput(compiler_output, relative_paths):
+  """Filers actool compilation output.
+
+  See WriteFilteredCompilerOutput() for details.
+
   Args:
     compiler_output: string containing the output generated by the
       compiler (contains both stdout and stderr)
@@ -73,25 +203,84 @@ def FilterCompilerOutput(compiler_output, relative_paths):
     success, then the output will be empty, otherwise it will use
     relative path and omit any irrelevant output.
   """
+  filtered_output = io.StringIO()
+  WriteFilteredCompilerOutput(compiler_output.splitlines(), relative_paths,
+                              AbsolutePathsPattern(relative_paths),
+                              filtered_output)
+  return filtered_output.getvalue()
 
-  filtered_output = []
-  current_section = None
-  data_in_section = False
-  for line in compiler_output.splitlines():
-    match = SECTION_HEADER.search(line)
-    if match is not None:
-      data_in_section = False
-      current_section = match.group(1)
-      continue
-    if current_section and current_section != NOTICE_SECTION:
-      if not data_in_section:
-        data_in_section = True
-        filtered_output.append('/* %s */\n' % current_section)
 
-      fixed_line = FixAbsolutePathInLine(line, relative_paths)
-      filtered_output.append(fixed_line + '\n')
+def AbsolutePath(path, cwd):
+  """Returns the normalized absolute version of |path|.
+
+  Equivalent to os.path.abspath() but uses |cwd| instead of calling
+  os.getcwd(), and does not join |path| if it is already absolute.
+  """
+  if os.path.isabs(path):
+    return os.path.normpath(path)
+  return os.path.normpath(os.path.join(cwd, path))
+
+
+def FindSpecialAssets(path):
+  """Returns the asset catalogs in |path| that need special treatment.
+
+  os.scandir() is used as the type of the entries is returned when reading
+  the directory, which avoids one stat call per entry.
+
+  Args:
+    path: path to an .xcassets bundle
+
+  Returns:
+    A list of (asset type, asset name) tuples for each asset catalog with
+    a type in ACTOOL_FLAG_FOR_ASSET_TYPE, in the order of the directory.
+    The list is empty if |path| does not exist or is not a directory.
+  """
+  special_assets = []
+  try:
+    entries = os.scandir(path)
+  except (FileNotFoundError, NotADirectoryError):
+    return special_assets
+
+  with entries:
+    for entry in entries:
+      if not entry.is_dir():
+        continue
+
+      asset_name, asset_type = os.path.splitext(entry.name)
+      if asset_type not in ACTOOL_FLAG_FOR_ASSET_TYPE:
+        continue
+
+      special_assets.append((asset_type, asset_name))
+
+  return special_assets
+
+
+def FindSpecialAssetsInInputs(inputs):
+  """Returns the asset catalogs in |inputs| that need special treatment.
 
-  return ''.join(filtered_output)
+  When there are multiple inputs, the directories are scanned concurrently,
+  but the results are returned in the order of |inputs| so that they do not
+  depend on the scheduling.
+
+  Args:
+    inputs: list of paths to .xcassets bundles
+
+  Returns:
+    A list of (asset type, asset name) tuples, see FindSpecialAssets().
+  """
+  if not inputs:
+    return []
+
+  if len(inputs) == 1:
+    return FindSpecialAssets(inputs[0])
+
+  special_assets = []
+  with concurrent.futures.ThreadPoolExecutor(
+      max_workers=min(MAX_SCAN_WORKERS, len(inputs))) as executor:
+    for input_special_assets in executor.map(FindSpecialAssets, inputs):
+      special_assets.extend(input_special_assets)
+
+  return special_assets
 
 
 def CompileAssetCatalog(output, platform, target_environment, product_type,
@@ -125,99 +314,86 @@ def CompileAssetCatalog(output, platform, target_environment, product_type,
   if product_type != '':
     command.extend(['--product-type', product_type])
 
+  # The target environment is only meaningful for iOS.
   if platform == 'mac':
-    command.extend([
-        '--platform',
-        'macosx',
-        '--target-device',
-        'mac',
-    ])
-  elif platform == 'ios':
-    if target_environment == 'simulator':
-      command.extend([
-          '--platform',
-          'iphonesimulator',
-          '--target-device',
-          'iphone',
-          '--target-device',
-          'ipad',
-      ])
-    elif target_environment == 'device':
-      command.extend([
-          '--platform',
-          'iphoneos',
-          '--target-device',
-          'iphone',
-          '--target-device',
-          'ipad',
-      ])
-    elif target_environment == 'catalyst':
-      command.extend([
-          '--platform',
-          'macosx',
-          '--target-device',
-          'ipad',
-          '--ui-framework-family',
-          'uikit',
-      ])
+    target_environment = ''
+  command.extend(
+      ACTOOL_FLAGS_FOR_PLATFORM.get((platform, target_environment), ()))
 
   # Scan the input directories for the presence of asset catalog types that
   # require special treatment, and if so, add them to the actool command-line.
-  for relative_path in inputs:
-
-    if not os.path.isdir(relative_path):
-      continue
-
-    for file_or_dir_name in os.listdir(relative_path):
-      if not os.path.isdir(os.path.join(relative_path, file_or_dir_name)):
-        continue
-
-      asset_name, asset_type = os.path.splitext(file_or_dir_name)
-      if asset_type not in ACTOOL_FLAG_FOR_ASSET_TYPE:
-        continue
-
-      command.extend([ACTOOL_FLAG_FOR_ASSET_TYPE[asset_type], asset_name])
-
-  # Always ask actool to generate a partial Info.plist file. If no path
-  # has been given by the caller, use a temporary file name.
-  temporary_file = None
-  if not partial_info_plist:
-    temporary_file = tempfile.NamedTemporaryFile(suffix='.plist')
-    partial_info_plist = temporary_file.name
+  for asset_type, asset_name in FindSpecialAssetsInInputs(inputs):
+    command.extend([ACTOOL_FLAG_FOR_ASSET_TYPE[asset_type], asset_name])
 
-  command.extend(['--output-partial-info-plist', partial_info_plist])
+  # actool crashes if paths are relative, so convert input and output paths
+  # to absolute paths, and record the relative paths to fix them back when
+  # filtering the output.
+  # The current directory is fetched once as os.path.abspath() would call
+  # os.getcwd() for each path.
+  cwd = os.getcwd()
+  absolute_output = AbsolutePath(output, cwd)
+  absolute_output_dir = os.path.dirname(absolute_output)
+  absolute_inputs = [
+      AbsolutePath(relative_path, cwd)
+      for relative_path in inputs
+  ]
 
   # Dictionary used to convert absolute paths back to their relative form
   # in the output of actool.
-  relative_paths = {}
+  relative_paths = {
+      absolute_output: output,
+      absolute_output_dir: os.path.dirname(output),
+      **dict(zip(absolute_inputs, inputs)),
+  }
+  absolute_paths_pattern = AbsolutePathsPattern(relative_paths)
 
-  # actool crashes if paths are relative, so convert input and output paths
-  # to absolute paths, and record the relative paths to fix them back when
-  # filtering the output.
-  absolute_output = os.path.abspath(output)
-  relative_paths[output] = absolute_output
-  relative_paths[os.path.dirname(output)] = os.path.dirname(absolute_output)
-  command.extend(['--compile', os.path.dirname(os.path.abspath(output))])
+  # Always ask actool to generate a partial Info.plist file. If no path
+  # has been given by the caller, use a temporary file name. The temporary
+  # file is closed immediately (and deleted once actool has run) so that no
+  # file descriptor is held while actool writes to it. It is created right
+  # before the try block that deletes it so that it cannot leak.
+  partial_info_plist_is_temp = not partial_info_plist
+  if partial_info_plist_is_temp:
+    with tempfile.NamedTemporaryFile(suffix='.plist',
+                                     delete=False) as temporary_file:
+      partial_info_plist = temporary_file.name
 
-  for relative_path in inputs:
-    absolute_path = os.path.abspath(relative_path)
-    relative_paths[absolute_path] = relative_path
-    command.append(absolute_path)
+  command.extend(['--output-partial-info-plist', partial_info_plist])
+  command.extend(['--compile', absolute_output_dir])
+  command.extend(absolute_inputs)
 
   try:
     # Run actool and redirect stdout and stderr to the same pipe (as actool
     # is confused about what should go to stderr/stdout).
+    # The output is read line by line as it is produced instead of waiting
+    # for the process to terminate and then splitting the whole buffer. The
+    # default buffering (bufsize=-1) is spelled out on purpose as the output
+    # of actool can be large and must not be read unbuffered.
     process = subprocess.Popen(command,
                                stdout=subprocess.PIPE,
-                               stderr=subprocess.STDOUT)
-    stdout = process.communicate()[0].decode('utf-8')
+                               stderr=subprocess.STDOUT,
+                               bufsize=-1,
+                               encoding='utf-8')
+    # Only the raw lines are kept while actool runs, as whether they need to
+    # be filtered depends on its exit code. The output is then written
+    # directly to the standard error stream without any other copy. Make
+    # sure actool does not outlive the script if reading its output fails.
+    try:
+      with process.stdout:
+        output_lines = [line.rstrip('\n') for line in process.stdout]
+    except BaseException:
+      process.kill()
+      process.wait()
+      raise
+    process.wait()
 
     # If the invocation of `actool` failed, copy all the compiler output to
     # the standard error stream and exit. See https://crbug.com/1205775 for
     # example of compilation that failed with no error message due to filter.
     if process.returncode:
-      for line in stdout.splitlines():
-        fixed_line = FixAbsolutePathInLine(line, relative_paths)
+      for line in output_lines:
+        fixed_line = FixAbsolutePathInLine(line, relative_paths,
+                                           absolute_paths_pattern)
         sys.stderr.write(fixed_line + '\n')
       sys.exit(1)
 
@@ -225,14 +401,39 @@ def CompileAssetCatalog(output, platform, target_environment, product_type,
     # output is not empty after filtering, then report the compilation as a
     # failure (as some version of `actool` report error to stdout, yet exit
     # with an return code of zero).
-    stdout = FilterCompilerOutput(stdout, relative_paths)
-    if stdout:
-      sys.stderr.write(stdout)
+    if WriteFilteredCompilerOutput(output_lines, relative_paths,
+                                   absolute_paths_pattern, sys.stderr):
       sys.exit(1)
 
   finally:
-    if temporary_file:
-      temporary_file.close()
+    if partial_info_plist_is_temp:
+      try:
+        os.unlink(partial_info_plist)
+      except OSError:
+        pass
+
+
+def PrepareOutput(output):
+  """Checks that |output| is a compiled asset catalog path and removes it.
+
+  Exits with an error if |output| is not the path to an Assets.car file.
+  """
+  if os.path.basename(output) != 'Assets.car':
+    sys.stderr.write('output should be path to compiled asset catalog, not '
+                     'to the containing bundle: %s\n' % (output, ))
+    sys.exit(1)
+
+  # Try to remove the output as a file first as this requires no stat call
+  # in the common case. unlink() fails with EISDIR on Linux but with EPERM
+  # on macOS if the output is a directory.
+  try:
+    os.unlink(output)
+  except FileNotFoundError:
+    pass
+  except OSError:
+    if not os.path.isdir(output):
+      raise
+    shutil.rmtree(output)
 
 
 def Main():
@@ -273,16 +474,7 @@ def Main():
                       help='path to input assets catalog sources')
   args = parser.parse_args()
 
-  if os.path.basename(args.output) != 'Assets.car':
-    sys.stderr.write('output should be path to compiled asset catalog, not '
-                     'to the containing bundle: %s\n' % (args.output, ))
-    sys.exit(1)
-
-  if os.path.exists(args.output):
-    if os.path.isfile(args.output):
-      os.unlink(args.output)
-    else:
-      shutil.rmtree(args.output)
+  PrepareOutput(args.output)
 
   CompileAssetCatalog(args.output, args.platform, args.target_environment,
                       args.product_type, args.minimum_deployment_target,